@@ -1,11 +1,19 @@
 import streamlit as st
 import google.generativeai as genai
 import time
+import asyncio
 import json
 import os
+import shutil
+import math
+import hashlib
+from collections import OrderedDict, deque
+import re
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import pandas as pd
-import uuid
 import plotly.express as px
 
 # Configuration and setup
@@ -18,10 +26,15 @@ st.set_page_config(
 # Initialize session state variables
 if 'task_history' not in st.session_state:
     st.session_state.task_history = []
+if 'task_records' not in st.session_state:
+    st.session_state.task_records = {}
 if 'current_task_id' not in st.session_state:
     st.session_state.current_task_id = None
 if 'agent_messages' not in st.session_state:
     st.session_state.agent_messages = []
+if 'pending_future' not in st.session_state:
+    st.session_state.pending_future = None
+    st.session_state.pending_run = None
 if 'settings' not in st.session_state:
     st.session_state.settings = {
         'planner_model': "gemini-1.5-flash",
@@ -30,187 +43,792 @@ if 'settings' not in st.session_state:
         'critic_model': "gemini-1.5-flash",
         'max_steps': 10,
         'temperature': 0.7,
-        'verbose': True
+        'verbose': True,
+        'semantic_cache': False,
+        'context_chars': 4000,
+        'max_parallel_steps': 4,
+        'pipeline_mode': "Auto",
+        'agent_timeout': 60,
+        'run_timeout': 300
     }
 
-# Function to save task history to file
-def save_history():
-    with open('task_history.json', 'w') as f:
-        json.dump(st.session_state.task_history, f)
+# History is a slim append-only index plus one file per task for the full outputs
+INDEX_FILE = 'task_index.jsonl'
+TASKS_DIR = 'tasks'
+INDEX_FIELDS = ("id", "task", "timestamp", "completion_time", "planner_model", "executive_model")
+LEGACY_HISTORY_FILE = 'task_history.json'
 
-# Function to load task history from file
+@st.cache_resource(show_spinner=False)
+def get_history_writer():
+    # A single worker keeps writes ordered without making the UI wait on disk
+    return ThreadPoolExecutor(max_workers=1)
+
+def index_entry(task_record):
+    # Records imported from the legacy file predate the model fields
+    return {field: task_record.get(field) for field in INDEX_FIELDS}
+
+def task_record_path(task_id):
+    return os.path.join(TASKS_DIR, f"{task_id}.json")
+
+def write_history_record(task_record):
+    os.makedirs(TASKS_DIR, exist_ok=True)
+    with open(task_record_path(task_record["id"]), 'w') as f:
+        json.dump(task_record, f)
+    with open(INDEX_FILE, 'a') as f:
+        f.write(json.dumps(index_entry(task_record)) + '\n')
+
+def remove_history_files():
+    open(INDEX_FILE, 'w').close()
+    shutil.rmtree(TASKS_DIR, ignore_errors=True)
+
+# Function to save a task record to the history files
+def save_history(task_record):
+    get_history_writer().submit(write_history_record, task_record)
+
+# Function to clear the history files
+def clear_history():
+    get_history_writer().submit(remove_history_files)
+
+def migrate_legacy_history():
+    # One-time import of the old single-file history, renamed afterwards so it only runs once
+    if not os.path.exists(LEGACY_HISTORY_FILE) or os.path.exists(INDEX_FILE):
+        return
+    with open(LEGACY_HISTORY_FILE, 'r') as f:
+        records = json.load(f)
+    for task_record in records:
+        write_history_record(task_record)
+    os.replace(LEGACY_HISTORY_FILE, LEGACY_HISTORY_FILE + '.migrated')
+
+# Function to load the task history index from file
 def load_history():
-    if os.path.exists('task_history.json'):
-        with open('task_history.json', 'r') as f:
-            st.session_state.task_history = json.load(f)
-
-# Load history at startup
-try:
-    load_history()
-except:
-    st.session_state.task_history = []
+    # Run on the writer so concurrent sessions can't import the legacy file twice
+    get_history_writer().submit(migrate_legacy_history).result()
+    history = []
+    if os.path.exists(INDEX_FILE):
+        with open(INDEX_FILE, 'r') as f:
+            for line in f:
+                try:
+                    history.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Skip a partially written line
+                    continue
+    st.session_state.task_history = history
+
+# Function to load a full task record, only when it is displayed
+def load_task_record(task_id):
+    if task_id not in st.session_state.task_records:
+        try:
+            with open(task_record_path(task_id), 'r') as f:
+                st.session_state.task_records[task_id] = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+    return st.session_state.task_records[task_id]
+
+# Load history once per session, after that session state is the source of truth
+if 'history_loaded' not in st.session_state:
+    try:
+        load_history()
+    except:
+        st.session_state.task_history = []
+    st.session_state.history_loaded = True
+
+# genai.configure sets process-wide state, so the configured key is tracked process-wide too
+@st.cache_resource(show_spinner=False)
+def get_genai_config():
+    return {"api_key": None, "lock": threading.Lock()}
+
+def ensure_configured(api_key):
+    config = get_genai_config()
+    with config["lock"]:
+        if config["api_key"] != api_key:
+            genai.configure(api_key=api_key)
+            config["api_key"] = api_key
+
+# Gemini model cache
+@st.cache_resource(show_spinner=False, max_entries=64)
+def get_model(api_key, model_name, generation_config, system_instruction=None):
+    # api_key only separates cache entries, it doesn't isolate credentials: a model's
+    # gRPC client is created lazily from whatever key is configured at its first call,
+    # so concurrent sessions using different keys can still end up on the last configured one
+    return genai.GenerativeModel(
+        model_name=model_name,
+        generation_config=generation_config,
+        system_instruction=system_instruction
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_client_loop():
+    # Agent runs execute on this background loop so the script thread never blocks,
+    # and async Gemini clients stay bound to a loop that outlives each rerun
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+# Response caches shared across reruns and sessions, both bounded
+RESPONSE_CACHE_SIZE = 256
+SEMANTIC_CACHE_SIZE = 100
+SEMANTIC_CACHE_THRESHOLD = 0.95
+
+@st.cache_resource(show_spinner=False)
+def get_response_cache():
+    return OrderedDict()
+
+@st.cache_resource(show_spinner=False)
+def get_semantic_cache():
+    return deque(maxlen=SEMANTIC_CACHE_SIZE)
+
+def cached_response(cache_key):
+    cache = get_response_cache()
+    if cache_key not in cache:
+        return None
+    cache.move_to_end(cache_key)
+    return cache[cache_key]
+
+def cache_response(cache_key, text):
+    # Least recently used entries are evicted once the cache is full
+    cache = get_response_cache()
+    cache[cache_key] = text
+    cache.move_to_end(cache_key)
+    while len(cache) > RESPONSE_CACHE_SIZE:
+        cache.popitem(last=False)
+
+async def embed_task(task, timeout):
+    try:
+        result = await asyncio.wait_for(
+            genai.embed_content_async(model="models/text-embedding-004", content=task),
+            timeout
+        )
+        return result["embedding"]
+    except Exception:
+        return None
+
+def cosine_similarity(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+def find_similar_task(embedding, pool_key):
+    # Only results produced with the same models and temperature are reused
+    best_record, best_score = None, SEMANTIC_CACHE_THRESHOLD
+    for cached_embedding, cached_pool_key, record in list(get_semantic_cache()):
+        if cached_pool_key != pool_key:
+            continue
+        score = cosine_similarity(embedding, cached_embedding)
+        if score >= best_score:
+            best_record, best_score = record, score
+    return best_record
+
+# Context compaction between agents
+MARKDOWN_PREFIX = re.compile(r"^\s*(?:#+|[-*+•>])\s*")
+PREAMBLE = re.compile(r"^(?:sure|okay|ok|certainly|of course|here(?:'s| is| are))\b", re.IGNORECASE)
+
+def compact_text(text, max_chars):
+    # Strip markdown decoration, preambles and repeated lines, then cap the length
+    lines = []
+    seen = set()
+    for line in text.splitlines():
+        line = MARKDOWN_PREFIX.sub("", line).replace("**", "").replace("__", "").strip()
+        if not line or line.lower() in seen:
+            continue
+        if not lines and PREAMBLE.match(line):
+            continue
+        seen.add(line.lower())
+        lines.append(line)
+    
+    compact = "\n".join(lines)
+    if len(compact) > max_chars:
+        cut = compact.rfind("\n", 0, max_chars)
+        compact = compact[:cut if cut > 0 else max_chars]
+    return compact
+
+def truncate_text(text, max_chars):
+    # Cuts execution output to a fixed share without touching lines, so code keeps its layout
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rstrip() + "\n[truncated]"
+
+def format_step_results(results, max_chars):
+    # Every step gets an equal share of the budget so none is dropped entirely
+    share = max(max_chars // max(len(results), 1), 1)
+    return "\n\n".join(f"Step {label}\n{truncate_text(result, share)}" for label, result in results)
+
+def format_steps(steps):
+    # Steps are a list from the planner, older history records store them as text
+    if isinstance(steps, str):
+        return steps
+    return "\n".join(f"{i}. {step}" for i, step in enumerate(steps, 1))
+
+# Scoring of parallel refinement candidates
+REFINE_TEMPERATURES = (0.3, 0.7, 1.0)
+NUMBERED_ITEM = re.compile(r"^\s*\d+[.)]\s")
+
+def score_refinement(refinement):
+    # Favour structured answers (headings, list items, paragraphs) and damp raw length
+    structure = sum(
+        1 for line in refinement.splitlines()
+        if MARKDOWN_PREFIX.match(line) or NUMBERED_ITEM.match(line)
+    )
+    paragraphs = refinement.count("\n\n") + 1
+    return 2 * structure + paragraphs + math.log1p(len(refinement))
+
+# Stored in place of a response when an agent call times out
+TIMEOUT_RESULT = "[timeout]"
+# Sequential stages of the full pipeline that can each take up to agent_timeout:
+# planner/researcher, executive, critique/refine, and the critic and refiner fallback
+FULL_PIPELINE_STAGES = 5
+
+# Text agents are asked to end with this marker so generation stops right there
+STOP_SEQUENCE = "END_OF_RESPONSE"
 
 # Agent functions
 class Agent:
+    # Extra generation settings applied on top of the temperature
+    generation_config = {}
+    # Caps the output so a long answer can't inflate the next agent's prompt
+    max_output_tokens = 2000
+    # JSON agents turn this off, a stop marker would only risk cutting the JSON short
+    use_stop_sequence = True
+
     def __init__(self, role, model_name, temperature=0.7):
         self.role = role
         self.model_name = model_name
         self.temperature = temperature
 
-    def generate_response(self, prompt):
+    def build_generation_config(self):
+        config = {"temperature": self.temperature, "max_output_tokens": self.max_output_tokens}
+        if self.use_stop_sequence:
+            config["stop_sequences"] = [STOP_SEQUENCE]
+        config.update(self.generation_config)
+        return config
+
+    def response_cache_key(self, prompt, system_instruction=None):
+        prompt_hash = hashlib.blake2b(f"{system_instruction or ''}\0{prompt}".encode(), digest_size=16).hexdigest()
+        return (self.role, self.model_name, self.temperature, prompt_hash)
+
+    def store_response(self, prompt, text, system_instruction=None):
+        # JSON agents call this once their response has parsed, so a bad reply isn't replayed
+        cache_response(self.response_cache_key(prompt, system_instruction), text)
+
+    async def generate_response(self, run, prompt, log_entry=None, system_instruction=None):
+        if self.use_stop_sequence:
+            prompt += f"\n\nEnd your response with {STOP_SEQUENCE}."
+        cache_key = self.response_cache_key(prompt, system_instruction)
+        cached = cached_response(cache_key)
+        if cached is not None:
+            if log_entry is not None:
+                log_entry["message"] += cached
+            return cached
+        
+        timeout = run["settings"]['agent_timeout']
+        # Filled while streaming so a timeout can still return what already arrived
+        chunks = []
         try:
-            genai.configure(api_key=st.session_state.api_key)
-            model = genai.GenerativeModel(
-                model_name=self.model_name,
-                generation_config={"temperature": self.temperature}
+            model = get_model(
+                run["api_key"],
+                self.model_name,
+                self.build_generation_config(),
+                system_instruction
             )
-            response = model.generate_content(prompt)
-            return response.text
+            if log_entry is not None:
+                text = await asyncio.wait_for(self.stream_response(model, prompt, log_entry, chunks), timeout)
+            else:
+                response = await asyncio.wait_for(model.generate_content_async(prompt), timeout)
+                text = response.text
+            if "response_mime_type" not in self.generation_config:
+                cache_response(cache_key, text)
+            return text
+        except asyncio.TimeoutError:
+            if chunks:
+                warning = f"⚠️ Timed out after {timeout}s, this response is incomplete."
+                log_entry["message"] += f"\n\n{warning}"
+                return "".join(chunks) + f"\n\n{warning}"
+            
+            warning = f"⚠️ Timed out after {timeout}s, continuing without this response."
+            if log_entry is not None:
+                log_entry["message"] += f"\n\n{warning}"
+            else:
+                log_agent_message(run, self.role, warning)
+            return TIMEOUT_RESULT
         except Exception as e:
-            st.error(f"{self.role} Agent Error: {str(e)}")
-            return f"Error in {self.role} agent: {str(e)}"
+            error = f"Error in {self.role} agent: {str(e)}"
+            if log_entry is not None:
+                log_entry["message"] += error
+            else:
+                log_agent_message(run, self.role, error)
+            return error
+
+    async def stream_response(self, model, prompt, log_entry, chunks):
+        # Stream tokens into the log entry, the progress view re-renders it while the run is pending
+        response = await model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            chunks.append(chunk.text)
+            log_entry["message"] += chunk.text
+        return "".join(chunks)
 
 class PlannerAgent(Agent):
-    def plan_task(self, task):
-        prompt = f"""As a Task Planning Agent, break down this task into detailed, executable steps. 
-        Format the steps as a numbered list with clear instructions.
+    generation_config = {
+        "response_mime_type": "application/json",
+        "response_schema": {
+            "type": "object",
+            "properties": {
+                "steps": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "instruction": {"type": "string"},
+                            "independent": {"type": "boolean"}
+                        },
+                        "required": ["instruction", "independent"]
+                    }
+                }
+            }
+        }
+    }
+    max_output_tokens = 800
+    use_stop_sequence = False
+
+    async def plan_task(self, run, task, max_steps):
+        prompt = f"""As a Task Planning Agent, break down this task into at most {max_steps} detailed, executable steps. 
+        Return the steps as a JSON object with a "steps" array. Each item has an "instruction" with one clear instruction
+        and "independent", which is true only if the step can be carried out without the results of any other step.
         
         Task: {task}
         
         Provide a comprehensive plan that covers all aspects of the task."""
         
-        steps = self.generate_response(prompt)
-        log_agent_message("Planner", f"I've broken down the task into these steps:\n\n{steps}")
-        return steps
+        response = await self.generate_response(run, prompt)
+        try:
+            items = json.loads(response)["steps"]
+            steps = [item["instruction"] for item in items]
+            independent = [item.get("independent") is True for item in items]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            steps = None
+        if not isinstance(steps, list) or not all(isinstance(step, str) for step in steps):
+            # Keep whatever came back (e.g. an error message) as plain lines, treated as sequential
+            steps = [line.strip() for line in response.splitlines() if line.strip()]
+            independent = [False] * len(steps)
+        else:
+            self.store_response(prompt, response)
+        
+        log_agent_message(run, "Planner", f"I've broken down the task into these steps:\n\n{format_steps(steps)}")
+        return steps, independent
 
 class ResearcherAgent(Agent):
-    def gather_information(self, task, steps):
+    max_output_tokens = 1200
+
+    async def gather_information(self, run, task):
+        # Only depends on the task so it can run alongside the planner
         prompt = f"""As a Research Agent, gather relevant information to help complete this task.
         
         Task: {task}
-        Steps: {steps}
         
         Provide key information, facts, or data that would be helpful for executing this task."""
         
-        research = self.generate_response(prompt)
-        log_agent_message("Researcher", f"I've gathered this relevant information:\n\n{research}")
+        log_entry = log_agent_message(run, "Researcher", "I've gathered this relevant information:\n\n")
+        research = await self.generate_response(run, prompt, log_entry)
         return research
 
 class ExecutiveAgent(Agent):
-    def execute_task(self, task, steps, research):
-        prompt = f"""As an Executive Agent, execute the given steps based on the task description and research provided.
-        
-        Task: {task}
-        Steps: {steps}
-        Research: {research}
-        
+    async def execute_task(self, run, context):
+        prompt = """EXECUTE:
+        As an Executive Agent, execute the given steps based on the task description and research provided.
         Provide the complete solution with detailed execution of each step."""
         
-        execution = self.generate_response(prompt)
-        log_agent_message("Executive", f"I've executed the task. Here's the result:\n\n{execution}")
+        log_entry = log_agent_message(run, "Executive", "I've executed the task. Here's the result:\n\n")
+        execution = await self.generate_response(run, prompt, log_entry, context)
         return execution
 
-class CriticAgent(Agent):
-    def evaluate_solution(self, task, steps, research, execution):
-        prompt = f"""As a Critic Agent, evaluate the solution provided by the Executive Agent.
+    async def execute_step(self, run, context, number, step, previous_results=""):
+        prompt = f"""EXECUTE STEP:
+        As an Executive Agent, execute a single step of the plan for the task.
+        Provide the complete and detailed execution of this step only.
         
-        Task: {task}
-        Steps: {steps}
-        Research: {research}
-        Execution: {execution}
+        Step {number}: {step}
+        Results of previous steps: {previous_results or "None"}"""
+        
+        log_entry = log_agent_message(run, "Executive", f"Step {number}: {step}\n\n")
+        return await self.generate_response(run, prompt, log_entry, context)
+
+    async def execute_steps(self, run, context, steps, independent, max_parallel, context_chars):
+        # Independent steps fan out concurrently, dependent ones run in order afterwards
+        semaphore = asyncio.Semaphore(max_parallel)
+        results = {}
         
-        Provide constructive feedback, identify any issues or areas for improvement, and suggest refinements."""
+        async def run_step(number, step):
+            async with semaphore:
+                results[number] = await self.execute_step(run, context, number, step)
         
-        critique = self.generate_response(prompt)
-        log_agent_message("Critic", f"Here's my evaluation of the solution:\n\n{critique}")
+        numbered = list(enumerate(steps, 1))
+        await asyncio.gather(*[
+            run_step(number, step)
+            for (number, step), is_independent in zip(numbered, independent) if is_independent
+        ])
+        for number, step in numbered:
+            if number not in results:
+                previous = format_step_results([(n, results[n]) for n in sorted(results)], context_chars)
+                results[number] = await self.execute_step(run, context, number, step, previous)
+        
+        step_results = format_step_results(
+            [(f"{number}: {step}", results[number]) for number, step in numbered], context_chars
+        )
+        return await self.aggregate_steps(run, context, step_results)
+
+    async def aggregate_steps(self, run, context, step_results):
+        prompt = f"""AGGREGATE:
+        As an Executive Agent, combine the results of the individually executed steps into one complete solution.
+        Provide the complete solution, keeping the detail of each step and removing any repetition.
+        
+        Step Results: {step_results}"""
+        
+        log_entry = log_agent_message(run, "Executive", "I've executed the task. Here's the result:\n\n")
+        return await self.generate_response(run, prompt, log_entry, context)
+
+class CriticAgent(Agent):
+    max_output_tokens = 800
+
+    async def evaluate_solution(self, run, context, execution):
+        prompt = f"""CRITIQUE:
+        As a Critic Agent, evaluate the solution provided by the Executive Agent.
+        Provide constructive feedback, identify any issues or areas for improvement, and suggest refinements.
+        
+        Execution: {execution}"""
+        
+        log_entry = log_agent_message(run, "Critic", "Here's my evaluation of the solution:\n\n")
+        critique = await self.generate_response(run, prompt, log_entry, context)
         return critique
 
 class RefinerAgent(Agent):
-    def refine_solution(self, task, execution, critique):
-        prompt = f"""As a Refiner Agent, improve the solution based on the critique provided.
+    async def refine_solution(self, run, context, execution, critique):
+        prompt = f"""REFINE:
+        As a Refiner Agent, improve the solution based on the critique provided.
+        Provide an improved and refined solution that addresses the issues identified in the critique.
         
-        Task: {task}
         Current Solution: {execution}
-        Critique: {critique}
-        
-        Provide an improved and refined solution that addresses the issues identified in the critique."""
+        Critique: {critique}"""
         
-        refinement = self.generate_response(prompt)
-        log_agent_message("Refiner", f"I've refined the solution:\n\n{refinement}")
+        log_entry = log_agent_message(run, "Refiner", "I've refined the solution:\n\n")
+        refinement = await self.generate_response(run, prompt, log_entry, context)
         return refinement
 
+class CritiqueAndRefineAgent(Agent):
+    generation_config = {"response_mime_type": "application/json"}
+    max_output_tokens = 2800
+    use_stop_sequence = False
+
+    async def critique_and_refine(self, run, context, execution):
+        prompt = f"""CRITIQUE AND REFINE:
+        As a Critic and Refiner Agent, evaluate the solution provided by the Executive Agent and then improve it based on your evaluation.
+        Provide constructive feedback that identifies any issues or areas for improvement, then provide an improved and refined solution that addresses them.
+        Respond in JSON: {{"critique": "...", "refinement": "..."}}
+        
+        Execution: {execution}"""
+        
+        response = await self.generate_response(run, prompt, system_instruction=context)
+        # A timeout is reported as such, not as a bad reply, so the caller doesn't fall back to more calls
+        if response == TIMEOUT_RESULT:
+            return TIMEOUT_RESULT
+        try:
+            result = json.loads(response)
+            critique, refinement = result["critique"], result["refinement"]
+        except (ValueError, KeyError, TypeError):
+            return None
+        if not isinstance(critique, str) or not isinstance(refinement, str):
+            return None
+        self.store_response(prompt, response, context)
+        return critique, refinement
+
+class FastPathAgent(Agent):
+    generation_config = {
+        "response_mime_type": "application/json",
+        "response_schema": {
+            "type": "object",
+            "properties": {
+                "steps": {"type": "array", "items": {"type": "string"}},
+                "research": {"type": "string"},
+                "execution": {"type": "string"},
+                "critique": {"type": "string"},
+                "refinement": {"type": "string"}
+            }
+        }
+    }
+    max_output_tokens = 3000
+    use_stop_sequence = False
+
+    async def solve(self, run, task):
+        prompt = f"""Plan, research, execute, critique, and refine the following task in one response.
+        
+        Task: {task}
+        
+        Respond in JSON with "steps" (a list of short instructions), "research" (key facts), "execution" (the solution),
+        "critique" (issues with the solution) and "refinement" (the improved final solution)."""
+        
+        response = await self.generate_response(run, prompt)
+        if response == TIMEOUT_RESULT:
+            return TIMEOUT_RESULT
+        try:
+            result = json.loads(response)
+            fields = {field: result[field] for field in ("steps", "research", "execution", "critique", "refinement")}
+        except (ValueError, KeyError, TypeError):
+            return None
+        if not isinstance(fields["steps"], list) or not all(isinstance(step, str) for step in fields["steps"]):
+            return None
+        if not all(isinstance(fields[field], str) for field in ("research", "execution", "critique", "refinement")):
+            return None
+        self.store_response(prompt, response)
+        
+        log_agent_message(run, "Executive", f"I've solved the task in a single pass:\n\n{fields['refinement']}")
+        return fields
+
 # Helper functions
-def log_agent_message(agent_name, message):
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    st.session_state.agent_messages.append({
+def log_agent_message(run, agent_name, message):
+    # Seconds since the run started, formatted only when rendered
+    elapsed = time.time() - run["start_time"]
+    run["messages"].append({
         "agent": agent_name,
         "message": message,
-        "timestamp": timestamp
+        "elapsed": elapsed
     })
+    return run["messages"][-1]
+
+# Short tasks without multi-step wording are routed to the single-call fast path
+MULTI_STEP_TASK = re.compile(r"\b(?:then|steps?|list|compare|contrast)\b", re.IGNORECASE)
+
+def should_use_full_pipeline(task):
+    return len(task) >= 200 or bool(MULTI_STEP_TASK.search(task))
 
 def generate_task_id():
-    return str(uuid.uuid4())[:8]
+    return secrets.token_hex(4)
+
+# Agents hold no per-run state, so one set per model/temperature combination is reused across tasks
+def agent_pool_key(settings):
+    return (
+        settings['planner_model'],
+        settings['researcher_model'],
+        settings['executive_model'],
+        settings['critic_model'],
+        settings['temperature']
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_agent_pool(pool_key):
+    planner_model, researcher_model, executive_model, critic_model, temperature = pool_key
+    return {
+        "planner": PlannerAgent("Planner", planner_model, temperature),
+        "researcher": ResearcherAgent("Researcher", researcher_model, temperature),
+        "executive": ExecutiveAgent("Executive", executive_model, temperature),
+        "critic": CriticAgent("Critic", critic_model, temperature),
+        "refiner": RefinerAgent("Refiner", executive_model, temperature),
+        "critic_refiners": [
+            # The refinement is the final deliverable, so it uses the executive model like the Refiner
+            CritiqueAndRefineAgent("Critic", executive_model, refine_temperature)
+            for refine_temperature in REFINE_TEMPERATURES
+        ],
+        "fast_path": FastPathAgent("Executive", executive_model, temperature)
+    }
+
+async def run_full_pipeline(run, task_record):
+    task = run["task"]
+    settings = run["settings"]
+    
+    # Fetch the pooled agents for these settings
+    agents = get_agent_pool(agent_pool_key(settings))
+    planner = agents["planner"]
+    researcher = agents["researcher"]
+    executive = agents["executive"]
+    critic = agents["critic"]
+    refiner = agents["refiner"]
+    critic_refiners = agents["critic_refiners"]
+    
+    # Step 1 & 2: Planning and research are independent, run them concurrently
+    run["status"] = "Planning task steps and gathering relevant information..."
+    (task_record["steps"], independent), task_record["research"] = await asyncio.gather(
+        planner.plan_task(run, task, settings['max_steps']),
+        researcher.gather_information(run, task)
+    )
+    
+    # Later agents get compacted copies, the full versions are kept for display
+    context_chars = settings['context_chars']
+    steps_compact = compact_text(format_steps(task_record["steps"]), context_chars)
+    research_compact = compact_text(task_record["research"], context_chars)
+    
+    # Every later agent gets the same system instruction prefix so provider-side
+    # prefix caching can reuse it, only the role-specific suffix changes
+    shared_prefix = f"TASK:\n{task}\n\nSTEPS:\n{steps_compact}\n\nRESEARCH:\n{research_compact}\n\n"
+    
+    # Step 3: Execution, fanned out per step when the planner marked at least two steps independent
+    run["status"] = "Executing the task..."
+    if sum(independent) >= 2:
+        task_record["execution"] = await executive.execute_steps(
+            run, shared_prefix, task_record["steps"], independent, settings['max_parallel_steps'], context_chars
+        )
+    else:
+        task_record["execution"] = await executive.execute_task(run, shared_prefix)
+    
+    # Nothing to critique or refine if execution timed out
+    if task_record["execution"] == TIMEOUT_RESULT:
+        task_record["critique"] = task_record["refinement"] = TIMEOUT_RESULT
+        return
+    
+    # Step 4 & 5: Critique and refinement in a single call, with candidates at several
+    # temperatures running concurrently and the best scoring refinement kept
+    run["status"] = "Evaluating and refining the solution..."
+    candidates = await asyncio.gather(*[
+        critic_refiner.critique_and_refine(run, shared_prefix, task_record["execution"])
+        for critic_refiner in critic_refiners
+    ])
+    timed_out = all(candidate == TIMEOUT_RESULT for candidate in candidates)
+    candidates = [candidate for candidate in candidates if isinstance(candidate, tuple)]
+    
+    if timed_out:
+        # Every candidate stalled, separate critic and refiner calls would only stall too
+        task_record["critique"] = task_record["refinement"] = TIMEOUT_RESULT
+    elif candidates:
+        task_record["critique"], task_record["refinement"] = max(candidates, key=lambda c: score_refinement(c[1]))
+        log_agent_message(run, "Critic", f"Here's my evaluation of the solution:\n\n{task_record['critique']}")
+        log_agent_message(run, "Refiner", f"I've refined the solution:\n\n{task_record['refinement']}")
+    else:
+        # Fall back to separate calls if no combined response was valid JSON
+        run["status"] = "Evaluating the solution..."
+        task_record["critique"] = await critic.evaluate_solution(run, shared_prefix, task_record["execution"])
+        if task_record["critique"] == TIMEOUT_RESULT:
+            task_record["refinement"] = TIMEOUT_RESULT
+            return
+        
+        run["status"] = "Refining the solution..."
+        task_record["refinement"] = await refiner.refine_solution(run, shared_prefix, task_record["execution"], task_record["critique"])
 
-def run_agents(task):
-    # Create a new task record
+async def run_agents_async(run):
+    # Runs on the background loop, so it only touches the run dict and never st.*
+    task = run["task"]
+    settings = run["settings"]
     task_id = generate_task_id()
-    st.session_state.current_task_id = task_id
-    st.session_state.agent_messages = []
     
     task_record = {
         "id": task_id,
         "task": task,
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "steps": "",
+        "steps": [],
         "research": "",
         "execution": "",
         "critique": "",
         "refinement": "",
-        "completion_time": 0
+        "completion_time": 0,
+        "planner_model": settings['planner_model'],
+        "executive_model": settings['executive_model']
     }
     
     start_time = time.time()
     
-    # Initialize agents
-    planner = PlannerAgent("Planner", st.session_state.settings['planner_model'], st.session_state.settings['temperature'])
-    researcher = ResearcherAgent("Researcher", st.session_state.settings['researcher_model'], st.session_state.settings['temperature'])
-    executive = ExecutiveAgent("Executive", st.session_state.settings['executive_model'], st.session_state.settings['temperature'])
-    critic = CriticAgent("Critic", st.session_state.settings['critic_model'], st.session_state.settings['temperature'])
-    refiner = RefinerAgent("Refiner", st.session_state.settings['executive_model'], st.session_state.settings['temperature'])
+    # Reuse the result of a near-identical earlier task if semantic caching is on
+    embedding = None
+    if settings['semantic_cache']:
+        embedding = await embed_task(task, settings['agent_timeout'])
+        cached_record = find_similar_task(embedding, agent_pool_key(settings)) if embedding is not None else None
+        if cached_record is not None:
+            for field in ("steps", "research", "execution", "critique", "refinement"):
+                task_record[field] = cached_record[field]
+            log_agent_message(run, "Cache", f"Reused the result of a similar task:\n\n{cached_record['task']}")
+            task_record["completion_time"] = round(time.time() - start_time, 2)
+            save_history(task_record)
+            return task_record
     
-    # Run the agent workflow
-    with st.status("Running AI Agents...", expanded=True) as status:
-        # Step 1: Planning
-        status.update(label="Planning task steps...")
-        task_record["steps"] = planner.plan_task(task)
-        
-        # Step 2: Research
-        status.update(label="Gathering relevant information...")
-        task_record["research"] = researcher.gather_information(task, task_record["steps"])
-        
-        # Step 3: Execution
-        status.update(label="Executing the task...")
-        task_record["execution"] = executive.execute_task(task, task_record["steps"], task_record["research"])
-        
-        # Step 4: Critique
-        status.update(label="Evaluating the solution...")
-        task_record["critique"] = critic.evaluate_solution(task, task_record["steps"], task_record["research"], task_record["execution"])
-        
-        # Step 5: Refinement
-        status.update(label="Refining the solution...")
-        task_record["refinement"] = refiner.refine_solution(task, task_record["execution"], task_record["critique"])
-        
-        status.update(label="Task completed!", state="complete")
+    # Simple tasks can be answered in one call, fall back to the full pipeline if that fails
+    result = None
+    mode = settings['pipeline_mode']
+    if mode == "Fast path" or (mode == "Auto" and not should_use_full_pipeline(task)):
+        run["status"] = "Solving the task in a single call..."
+        fast_path = get_agent_pool(agent_pool_key(settings))["fast_path"]
+        result = await fast_path.solve(run, task)
+    
+    # After a fast path timeout, only try the full pipeline if the run budget covers its stages
+    remaining = settings['run_timeout'] - (time.time() - run["start_time"])
+    if result == TIMEOUT_RESULT and remaining < FULL_PIPELINE_STAGES * settings['agent_timeout']:
+        task_record.update({
+            "steps": [], "research": TIMEOUT_RESULT, "execution": TIMEOUT_RESULT,
+            "critique": TIMEOUT_RESULT, "refinement": TIMEOUT_RESULT
+        })
+    elif isinstance(result, dict):
+        task_record.update(result)
+    else:
+        await run_full_pipeline(run, task_record)
+    
+    run["status"] = "Task completed!"
     
     # Calculate completion time
     task_record["completion_time"] = round(time.time() - start_time, 2)
     
-    # Add to history
-    st.session_state.task_history.append(task_record)
-    save_history()
+    if embedding is not None:
+        get_semantic_cache().append((embedding, agent_pool_key(settings), task_record))
+    
+    save_history(task_record)
     
     return task_record
 
+def start_run(task):
+    # Only one run per session, a second one would orphan the first
+    if st.session_state.pending_future is not None:
+        return
+    
+    # Snapshot everything the pipeline needs so it can run off the script thread
+    run = {
+        "task": task,
+        "api_key": st.session_state.api_key,
+        "settings": dict(st.session_state.settings),
+        "messages": [],
+        "status": "Running AI Agents...",
+        "start_time": time.time()
+    }
+    # Another session may have configured a different key since this session's sidebar ran
+    ensure_configured(run["api_key"])
+    st.session_state.pending_run = run
+    st.session_state.pending_future = asyncio.run_coroutine_threadsafe(run_agents_async(run), get_client_loop())
+
+def collect_finished_run():
+    future = st.session_state.pending_future
+    if future is None or not future.done():
+        return
+    
+    run = st.session_state.pending_run
+    st.session_state.pending_future = None
+    st.session_state.pending_run = None
+    st.session_state.agent_messages = run["messages"]
+    if future.cancelled():
+        st.warning("Agent run cancelled.")
+        return
+    try:
+        task_record = future.result()
+    except Exception as e:
+        st.error(f"Agent run failed: {str(e)}")
+        return
+    
+    # Add to history
+    st.session_state.task_history.append(index_entry(task_record))
+    st.session_state.task_records[task_record["id"]] = task_record
+    st.session_state.current_task_id = task_record["id"]
+
+@st.fragment(run_every=0.5)
+def run_progress():
+    if st.session_state.pending_future is None:
+        return
+    if st.session_state.pending_future.done():
+        st.rerun()
+    
+    run = st.session_state.pending_run
+    # Cancelling the future also cancels the pipeline task on the background loop
+    if time.time() - run["start_time"] > run["settings"]['run_timeout']:
+        st.session_state.pending_future.cancel()
+        st.rerun()
+    if st.button("Cancel", key="cancel_run"):
+        st.session_state.pending_future.cancel()
+        st.rerun()
+    
+    with st.status(run["status"], expanded=True):
+        for message in list(run["messages"]):
+            with st.chat_message(message["agent"]):
+                st.write(f"**+{message['elapsed']:.1f}s**")
+                st.write(message["message"])
+
 # UI Components
 def sidebar_ui():
     with st.sidebar:
@@ -223,6 +841,7 @@ def sidebar_ui():
             type="password"
         )
         st.session_state.api_key = api_key
+        ensure_configured(api_key)
         
         st.divider()
         
@@ -245,6 +864,17 @@ def sidebar_ui():
             value=0.7,
             step=0.1
         )
+        st.session_state.settings['pipeline_mode'] = st.radio(
+            "Pipeline",
+            ["Auto", "Full pipeline", "Fast path"],
+            index=0,
+            horizontal=True,
+            help="Auto answers short, single-step tasks with one combined call"
+        )
+        st.session_state.settings['semantic_cache'] = st.toggle(
+            "Reuse results for similar tasks",
+            value=st.session_state.settings['semantic_cache']
+        )
         
         st.divider()
         
@@ -259,7 +889,9 @@ def sidebar_ui():
             
         if st.button("Clear History"):
             st.session_state.task_history = []
-            save_history()
+            st.session_state.task_records = {}
+            get_semantic_cache().clear()
+            clear_history()
             st.rerun()
 
 def main_area():
@@ -273,21 +905,22 @@ def main_area():
         
         col_btn1, col_btn2 = st.columns([1, 3])
         with col_btn1:
-            if st.button("Run AI Agents", type="primary", use_container_width=True):
+            if st.button("Run AI Agents", type="primary", use_container_width=True,
+                         disabled=st.session_state.pending_future is not None):
                 if task:
-                    task_record = run_agents(task)
+                    start_run(task)
+                    # Rerun so the button re-renders disabled while the run is pending
                     st.rerun()
                 else:
                     st.warning("Please enter a task.")
+        
+        if st.session_state.pending_future is not None:
+            run_progress()
 
 def display_results():
     if st.session_state.current_task_id is not None:
-        # Find the task record
-        task_record = None
-        for task in st.session_state.task_history:
-            if task["id"] == st.session_state.current_task_id:
-                task_record = task
-                break
+        # Load the full task record on demand
+        task_record = load_task_record(st.session_state.current_task_id)
         
         if task_record:
             st.header(f"Task: {task_record['task']}")
@@ -296,7 +929,7 @@ def display_results():
             
             with tab1:
                 st.subheader("📋 Planned Steps")
-                st.write(task_record["steps"])
+                st.write(format_steps(task_record["steps"]))
             
             with tab2:
                 st.subheader("🔍 Research")
@@ -318,17 +951,48 @@ def display_results():
             st.subheader("🤖 Agent Communication Log")
             for message in st.session_state.agent_messages:
                 with st.chat_message(message["agent"]):
-                    st.write(f"**{message['timestamp']}**")
+                    st.write(f"**+{message['elapsed']:.1f}s**")
                     st.write(message["message"])
 
+@st.cache_data(show_spinner=False, max_entries=1)
+def history_frame(history_len, last_task_id, _history):
+    # Keyed on the history length and newest id so the list itself isn't hashed each rerun
+    return pd.DataFrame(_history)
+
+def analytics_ui():
+    history = st.session_state.task_history
+    df = history_frame(len(history), history[-1]["id"], history)
+    
+    with st.expander("📊 Task Analytics"):
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Tasks", len(df))
+        col2.metric("Avg. Completion Time", f"{df['completion_time'].mean():.1f}s")
+        col3.metric("Fastest Task", f"{df['completion_time'].min():.1f}s")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            by_planner = df.groupby('planner_model', as_index=False)['completion_time'].mean()
+            st.plotly_chart(
+                px.bar(by_planner, x='planner_model', y='completion_time', title="Avg. Time by Planner Model"),
+                use_container_width=True
+            )
+        with col2:
+            by_executive = df.groupby('executive_model', as_index=False)['completion_time'].mean()
+            st.plotly_chart(
+                px.bar(by_executive, x='executive_model', y='completion_time', title="Avg. Time by Executive Model"),
+                use_container_width=True
+            )
+
 # Main app layout
 def main():
+    collect_finished_run()
     sidebar_ui()
     main_area()
     
     if st.session_state.task_history:
         st.divider()
         display_results()
+        analytics_ui()
 
 if __name__ == "__main__":
     main()